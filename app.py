@@ -2,15 +2,25 @@ import streamlit as st
 from pathlib import Path
 import os
 import sys
-import time
 import json
 import base64
+import html
+import shutil
+import threading
+import uuid
+from collections import deque
 from datetime import datetime
+from urllib.parse import quote
 import importlib
 
 ROOT = Path(__file__).parent.resolve()
 sys.path.append(str(ROOT))
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Import user modules (they must exist)
 try:
     from regulatory import regupdate
@@ -30,7 +40,9 @@ except Exception as e:
 
 try:
     import chatbot
-    importlib.reload(chatbot)
+    # Reloading wipes chatbot's index cache and HTTP session; opt in for development only.
+    if os.getenv("DEV_RELOAD"):
+        importlib.reload(chatbot)
 except Exception as e:
     chatbot = None
 
@@ -40,8 +52,11 @@ st.set_page_config(page_title="AI Regulatory Compliance Checker", page_icon="⚖
 # Storage paths (app-local defaults)
 STORAGE_DIR = ROOT / "regulatory_storage"
 CONTRACTS_DIR = ROOT / "docs" / "contracts"
+# Served by Streamlit at /app/static (see .streamlit/config.toml)
+STATIC_DIR = ROOT / "static"
 STORAGE_DIR.mkdir(parents=True, exist_ok=True)
 CONTRACTS_DIR.mkdir(parents=True, exist_ok=True)
+STATIC_DIR.mkdir(parents=True, exist_ok=True)
 
 # Default manifest paths
 CONTRACT_MANIFEST = STORAGE_DIR / "contract_manifests.json"
@@ -55,6 +70,17 @@ for p in (CONTRACT_MANIFEST, REG_MANIFEST):
 # -------------------------
 # Utilities
 # -------------------------
+def _json_loads(raw: bytes):
+    """Parse JSON bytes with orjson when available (stdlib fallback)."""
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+
+def _json_dumps(data) -> bytes:
+    if orjson:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, indent=2).encode("utf-8")
+
+
 def _save_uploaded_file(uploaded):
     dest = CONTRACTS_DIR / uploaded.name
     if dest.exists():
@@ -62,6 +88,7 @@ def _save_uploaded_file(uploaded):
         base, ext = os.path.splitext(uploaded.name)
         dest = CONTRACTS_DIR / f"{base}_{ts}{ext}"
     with open(dest, "wb") as f:
+        # UploadedFile is an in-memory BytesIO; getbuffer() is a zero-copy view of it
         f.write(uploaded.getbuffer())
     return dest.resolve()
 
@@ -73,15 +100,16 @@ def _register_contract(saved_path: Path):
     but keep older keys for backward compatibility."""
     manifest = load_contract_manifest()
     key = saved_path.stem
+    resolved = str(saved_path.resolve())
 
     entry = {
         "id": key,
         "orig_name": saved_path.name,
         # regupdate.py expects 'path' and 'current_version_path'
-        "path": str(saved_path.resolve()),
-        "current_version_path": str(saved_path.resolve()),
+        "path": resolved,
+        "current_version_path": resolved,
         # keep the old keys so other parts of your app still work:
-        "saved_path": str(saved_path.resolve()),
+        "saved_path": resolved,
         "registered_at": datetime.now().isoformat(),
         # regupdate will populate this after suggestions generation
         "last_suggestions_pdf": None,
@@ -108,13 +136,71 @@ def _get_file_name(key):
     return item.get("orig_name") or item.get("orig_filename") or key
 
 
+@st.cache_resource(show_spinner=False)
+def _static_previews():
+    """
+    Per-process registry of published previews: resolved path -> (mtime, link name).
+    Links left behind by a previous server process are removed on first use.
+    """
+    for stale in STATIC_DIR.glob("*.pdf"):
+        try:
+            stale.unlink()
+        except OSError:
+            pass
+    return threading.Lock(), {}
+
+
+def _publish_static_pdf(path: str, mtime: float) -> str:
+    """
+    Expose a PDF under ./static (served at /app/static) and return its link name.
+    The name is random, so a contract cannot be fetched by guessing its filename,
+    and each contract keeps only the link for its current version.
+    """
+    lock, links = _static_previews()
+    with lock:
+        current = links.get(path)
+        if current and current[0] == mtime and (STATIC_DIR / current[1]).exists():
+            return current[1]
+        dest = STATIC_DIR / f"{uuid.uuid4().hex}.pdf"
+        try:
+            os.link(path, dest)
+        except OSError:
+            shutil.copyfile(path, dest)
+        if current:
+            (STATIC_DIR / current[1]).unlink(missing_ok=True)
+        links[path] = (mtime, dest.name)
+        return dest.name
+
+
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=4)
+def _pdf_data_uri(path: str, mtime: float) -> str:
+    """Base64 data URI for a PDF, encoded at most once per (path, mtime)."""
+    b64 = base64.b64encode(Path(path).read_bytes()).decode("ascii")
+    return f"data:application/pdf;base64,{b64}"
+
+
 def _pdf_view(file_path):
     try:
-        with open(file_path, "rb") as f:
-            b64 = base64.b64encode(f.read()).decode()
-        return f'<iframe src="data:application/pdf;base64,{b64}" width="100%" height="600"></iframe>'
+        resolved = str(Path(file_path).resolve())
+        mtime = os.path.getmtime(file_path)
     except Exception:
         return "<p>Preview unavailable.</p>"
+    try:
+        src = f"./app/static/{quote(_publish_static_pdf(resolved, mtime))}"
+    except Exception:
+        # ./static not writable: fall back to an inline (memoized) data URI
+        try:
+            src = _pdf_data_uri(resolved, mtime)
+        except Exception:
+            return "<p>Preview unavailable.</p>"
+    title = html.escape(Path(file_path).name, quote=True)
+    return f'<iframe src="{src}" title="{title}" width="100%" height="600"></iframe>'
+
+
+def _append_chat_message(role, msg):
+    st.session_state.chat_history.append((role, msg))
+    if chatbot:
+        st.session_state.chat_history_lines.append(chatbot.format_history_line(role, msg))
 
 
 def _mark_index_dirty():
@@ -126,7 +212,7 @@ def _index_dirty():
 
 
 def _build_index():
-    if not rag:
+    if not rag or not chatbot:
         return None
     if not _index_dirty():
         return st.session_state.get("_rag_idx")
@@ -134,8 +220,11 @@ def _build_index():
     if not cpath:
         return None
     try:
-        docs = rag.read_contract_file(cpath)
-        idx = rag.build_vector_index(docs)
+        # The chatbot's process-wide cache owns the index, so the sidebar and the
+        # chat share one copy; keep only a reference here.
+        idx = chatbot.get_or_build_index(cpath)
+        if idx is None:
+            raise RuntimeError("index build failed")
         st.session_state._rag_idx = idx
         st.session_state._index_dirty = False
         return idx
@@ -149,7 +238,7 @@ def _build_index():
 # Manifest helpers (FIXED)
 # -------------------------
 
-def _resolve_manifest_path():
+def _find_manifest_path():
     """Return the exact manifest path used by regupdate.py."""
     try:
         if regupdate and hasattr(regupdate, "CONTRACT_MANIFESTS_JSON"):
@@ -159,12 +248,29 @@ def _resolve_manifest_path():
     return CONTRACT_MANIFEST.resolve()
 
 
+# Resolved once per script run instead of on every manifest read/write
+_RESOLVED_MANIFEST_PATH = _find_manifest_path()
+
+
+def _resolve_manifest_path():
+    return _RESOLVED_MANIFEST_PATH
+
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def _load_manifest_cached(path_str: str, mtime_ns: int, size: int) -> dict:
+    """Parse the manifest once per (path, mtime, size); regupdate writes change the
+    stamp. Size guards against coarse-mtime filesystems, as in regupdate._json_stamp;
+    max_entries drops the stamps of superseded writes."""
+    return _json_loads(Path(path_str).read_bytes())
+
+
 def load_contract_manifest():
     """Load manifest from regupdate's real manifest path."""
     try:
         path = _resolve_manifest_path()
         if path.exists():
-            return json.loads(path.read_text(encoding="utf-8"))
+            stat = path.stat()
+            return _load_manifest_cached(str(path), stat.st_mtime_ns, stat.st_size)
         return {}
     except Exception as e:
         st.error(f"Failed to load contract manifest: {e}")
@@ -176,7 +282,8 @@ def save_contract_manifest(data):
     try:
         path = _resolve_manifest_path()
         path.parent.mkdir(parents=True, exist_ok=True)
-        path.write_text(json.dumps(data, indent=2), encoding="utf-8")
+        path.write_bytes(_json_dumps(data))
+        _load_manifest_cached.clear()
     except Exception as e:
         st.error(f"Failed to save contract manifest: {e}")
 
@@ -196,6 +303,9 @@ if "_index_dirty" not in st.session_state:
     st.session_state._index_dirty = True
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
+if "chat_history_lines" not in st.session_state:
+    # Prompt-formatted tail of chat_history, each line formatted once when added
+    st.session_state.chat_history_lines = deque(maxlen=getattr(chatbot, "HISTORY_TURNS", 8))
 if "last_email_attachments" not in st.session_state:
     st.session_state.last_email_attachments = []
 if "rectified_preview" not in st.session_state:
@@ -309,23 +419,29 @@ elif page == "AI Chatbot":
 
         st.markdown("<div style='clear: both'></div>", unsafe_allow_html=True)
 
+        # Stream the reply to the message queued by _send_message_callback
+        pending = st.session_state.pop("_pending_chat_query", None)
+        if pending:
+            try:
+                resp = st.write_stream(chatbot.stream_chat_with_memory(
+                    user_message=pending,
+                    memory=st.session_state.chat_history,
+                    contract_path=st.session_state._active_contract_path,
+                    history_lines=st.session_state.chat_history_lines
+                ))
+            except Exception as e:
+                resp = f"Chatbot error: {e}"
+                st.error(resp)
+
+            _append_chat_message("assistant", resp)
+
     def _send_message_callback():
         q = st.session_state.get("chat_input", "").strip()
         if not q:
             return
 
-        st.session_state.chat_history.append(("user", q))
-
-        try:
-            resp = chatbot.chat_with_memory(
-                user_message=q,
-                memory=st.session_state.chat_history,
-                contract_path=st.session_state._active_contract_path
-            )
-        except Exception as e:
-            resp = f"Chatbot error: {e}"
-
-        st.session_state.chat_history.append(("assistant", resp))
+        _append_chat_message("user", q)
+        st.session_state._pending_chat_query = q
         st.session_state.chat_input = ""
 
     st.text_input(
@@ -335,11 +451,11 @@ elif page == "AI Chatbot":
         label_visibility="collapsed"
     )
 
-    if st.button("Send"):
-        _send_message_callback()
+    st.button("Send", on_click=_send_message_callback)
 
     if st.button("Clear Chat"):
         st.session_state.chat_history = []
+        st.session_state.chat_history_lines.clear()
 # -------------------------
 # Regulations
 # -------------------------
@@ -354,7 +470,7 @@ elif page == "Regulations":
             st.error("Failed to fetch regulations.")
 
     try:
-        regs = json.loads(REG_MANIFEST.read_text(encoding="utf-8"))
+        regs = _json_loads(REG_MANIFEST.read_bytes())
     except Exception:
         regs = {}
 
@@ -365,7 +481,8 @@ elif page == "Regulations":
             with st.expander(data.get("title", "Unnamed Regulation")):
                 st.write(f"Source: {data.get('source')}")
                 st.write(f"Updated: {data.get('last_updated')}")
-                st.text_area("Preview", data.get("text", "")[:1000], height=200)
+                text = regupdate.get_regulation_text(data) if regupdate else data.get("text", "")
+                st.text_area("Preview", text[:1000], height=200)
 
 
 # -------------------------
@@ -421,21 +538,11 @@ elif page == "Analysis & Rectification":
             with st.spinner("📄 Generating suggestions…"):
                 regupdate.apply_updates_to_contract(cid=selected_key, auto_apply=False)
 
-            # Retry to load updated manifest (up to 6 retries)
+            # apply_updates_to_contract writes the manifest before returning,
+            # so a single read sees the new suggestions path.
             manifest_path = _resolve_manifest_path()
-            suggestions_pdf = None
-
-            for attempt in range(6):
-                try:
-                    if manifest_path.exists():
-                        manifest_data = json.loads(manifest_path.read_text(encoding="utf-8"))
-                        entry = manifest_data.get(selected_key, {})
-                        suggestions_pdf = entry.get("last_suggestions_pdf")
-                        if suggestions_pdf and Path(suggestions_pdf).exists():
-                            break
-                except Exception:
-                    pass
-                time.sleep(0.35)
+            entry = load_contract_manifest().get(selected_key, {})
+            suggestions_pdf = entry.get("last_suggestions_pdf")
 
             st.info(f"Using manifest: {manifest_path}")
 
@@ -496,13 +603,14 @@ elif page == "Analysis & Rectification":
             st.write("- ", Path(p).name)
 
         recipient = st.text_input(
-            "Recipient email:",
+            "Recipient email(s), comma-separated:",
             key="analysis_recipient_input",
-            placeholder="example@company.com"
+            placeholder="example@company.com, legal@company.com"
         )
+        recipients = [r.strip() for r in recipient.split(",") if r.strip()]
 
         if st.button("📧 Send Email"):
-            if not recipient:
+            if not recipients:
                 st.error("Enter an email address.")
             else:
                 try:
@@ -511,7 +619,7 @@ elif page == "Analysis & Rectification":
                         st.error("No valid attachments found.")
                     else:
                         mail.send_compliance_update_email(
-                            recipient_email=recipient,
+                            recipient_email=recipients,
                             contract_title=filename,
                             regulation_name="AI Automated Report",
                             new_version="rectified",
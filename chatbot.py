@@ -1,13 +1,24 @@
 # chatbot.py — SMART CONTRACT-AWARE CHATBOT (FINAL VERSION)
 
 import os
+import re
 import json
-import time
+import threading
+import numpy as np
 import requests
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Optional, Tuple, Dict, Any
+from typing import List, Optional, Tuple, Dict, Any, Iterable, Iterator
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 load_dotenv()
 
 # -----------------------------------------
@@ -32,62 +43,131 @@ except:
 # -----------------------------------------
 # LLM WRAPPER
 # -----------------------------------------
-def call_groq(messages: list, max_tokens: int = 900) -> str:
-    if not GROQ_API_KEY:
-        return "⚠️ Missing GROQ_API_KEY."
-
-    headers = {
+def _make_session() -> requests.Session:
+    """Pooled keep-alive session so chat turns reuse the TLS connection to Groq."""
+    session = requests.Session()
+    session.headers.update({
         "Authorization": f"Bearer {GROQ_API_KEY}",
         "Content-Type": "application/json"
-    }
+    })
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset({"POST"}),
+        raise_on_status=False,
+    )
+    session.mount("https://", HTTPAdapter(max_retries=retry))
+    return session
+
+
+_SESSION = _make_session()
+
+
+def stream_groq(messages: list, max_tokens: int = 900) -> Iterator[str]:
+    """Yield completion tokens as Groq streams them (server-sent events)."""
+    if not GROQ_API_KEY:
+        yield "⚠️ Missing GROQ_API_KEY."
+        return
 
     payload = {
         "model": MODEL_NAME,
         "messages": messages,
         "temperature": TEMPERATURE,
-        "max_tokens": max_tokens
+        "max_tokens": max_tokens,
+        "stream": True
     }
 
     try:
-        resp = requests.post(GROQ_API_URL, json=payload, headers=headers, timeout=60)
-        resp.raise_for_status()
-        data = resp.json()
-        return data["choices"][0]["message"]["content"].strip()
+        with _SESSION.post(GROQ_API_URL, json=payload, timeout=60, stream=True) as resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[len(b"data:"):].strip()
+                if data == b"[DONE]":
+                    break
+                delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
     except Exception as e:
-        return f"⚠️ LLM Error: {e}"
+        yield f"⚠️ LLM Error: {e}"
+
+
+def call_groq(messages: list, max_tokens: int = 900) -> str:
+    return "".join(stream_groq(messages, max_tokens=max_tokens)).strip()
 
 
 # -----------------------------------------
 # RAG HELPERS
 # -----------------------------------------
-_INDEX_CACHE: Dict[str, Any] = {}
-_INDEX_CACHE_TIME: Dict[str, float] = {}
 INDEX_TTL = 3600  # 1 hour
+INDEX_CACHE_SIZE = 8  # at most this many contract indexes held in memory
+_INDEX_CACHE: TTLCache = TTLCache(maxsize=INDEX_CACHE_SIZE, ttl=INDEX_TTL)
+_INDEX_CACHE_LOCK = threading.Lock()  # Streamlit serves sessions from several threads
 
 
 def get_or_build_index(contract_path: str):
+    """
+    Vector index for a contract, shared by every caller in the process (the app's
+    sidebar and the chat). Keyed on (path, mtime) so a replaced file is re-indexed.
+    """
     if not contract_path or not rag:
         return None
 
-    key = str(Path(contract_path).resolve())
+    try:
+        p = Path(contract_path).resolve()
+        key = (str(p), p.stat().st_mtime_ns)
+    except OSError:
+        return None
 
-    # return cached index if fresh
-    if key in _INDEX_CACHE and time.time() - _INDEX_CACHE_TIME.get(key, 0) < INDEX_TTL:
-        return _INDEX_CACHE[key]
+    # return cached index if fresh (expired / least-recently-used entries are evicted)
+    with _INDEX_CACHE_LOCK:
+        idx = _INDEX_CACHE.get(key)
+    if idx is not None:
+        return idx
 
     # build index
     try:
         docs = rag.read_contract_file(contract_path)
         idx = rag.build_vector_index(docs)
-        _INDEX_CACHE[key] = idx
-        _INDEX_CACHE_TIME[key] = time.time()
+        with _INDEX_CACHE_LOCK:
+            _INDEX_CACHE[key] = idx
         return idx
     except Exception:
         return None
 
 
+RETRIEVAL_FETCH_K = 20  # candidates pulled from the (approximate) index before exact rerank
+
+
+def _rerank_search(idx, query: str, k: int, fetch_k: int = RETRIEVAL_FETCH_K) -> list:
+    """
+    Two-stage search on a LangChain FAISS store: oversample fetch_k candidates from
+    the quantized HNSW index, then rerank them by exact cosine similarity against the
+    float32 embeddings rag keeps in `idx.rerank_vectors`. Exact flat indexes (and any
+    store without those vectors) get a plain similarity search.
+    """
+    vectors = getattr(idx, "rerank_vectors", None)
+    if vectors is None:
+        return idx.similarity_search(query, k=k)
+
+    q = np.asarray(idx.embeddings.embed_query(query), dtype="float32")
+    _, ids = idx.index.search(q.reshape(1, -1), min(fetch_k, idx.index.ntotal))
+    positions = [int(i) for i in ids[0] if i != -1]
+    if not positions:
+        return []
+
+    cand = vectors[positions]
+    sims = cand @ q / (np.linalg.norm(cand, axis=1) * np.linalg.norm(q) + 1e-12)
+    top = np.argsort(-sims)[:k]
+    return [idx.docstore.search(idx.index_to_docstore_id[positions[j]]) for j in top]
+
+
 def retrieve_context_chunks(query: str, contract_path: Optional[str], k: int = 4) -> List[str]:
-    """Semantic search + fallback extraction."""
+    """Semantic search + fallback extraction.
+    Does not check intent: callers gate on is_contract_related first, as
+    _build_chat_messages does, so greetings never reach retrieval."""
     if not contract_path:
         return []
 
@@ -95,8 +175,10 @@ def retrieve_context_chunks(query: str, contract_path: Optional[str], k: int = 4
     idx = get_or_build_index(contract_path)
     if idx:
         try:
-            retriever = idx.as_retriever(search_kwargs={"k": k})
-            docs = retriever.get_relevant_documents(query)
+            try:
+                docs = _rerank_search(idx, query, k)
+            except Exception:
+                docs = idx.similarity_search(query, k=k)
             chunks = [d.page_content.strip() for d in docs if hasattr(d, "page_content")]
             if chunks:
                 return chunks
@@ -114,6 +196,50 @@ def retrieve_context_chunks(query: str, contract_path: Optional[str], k: int = 4
 # -----------------------------------------
 # SMART DETECTION: IS USER ASKING ABOUT CONTRACT?
 # -----------------------------------------
+# 1) Intent phrases that clearly request contract work
+CONTRACT_INTENT_PHRASES = [
+    "summarize", "summary", "summarise", "summarise the", "summarize the",
+    "analyze", "analyse", "analysis", "key clauses", "key clause",
+    "give me the clauses", "list clauses", "what are the clauses",
+    "extract clauses", "what is the termination", "termination clause",
+    "termination", "indemnit", "indemnify", "indemnity",
+    "liability", "obligation", "obligations", "scope", "agreement",
+    "contract", "contractual", "rectify", "rectification", "correct this",
+    "review the contract", "review contract", "summarise contract",
+    "summarize contract", "summarise the contract", "summarize the contract",
+    "key points", "key points of the contract", "important clauses",
+    "what does the contract say", "what does this contract say",
+    "what are the key points", "contract summary", "contract analysis",
+]
+
+# 2) Broad domain keywords (fallback)
+CONTRACT_KEYWORDS = [
+    "contract", "agreement", "clause", "term", "termination", "indemnity",
+    "liability", "obligation", "service", "scope", "client", "provider",
+    "party", "payment", "fees", "breach", "ip", "confidential", "governing",
+    "law", "non-compete", "risk", "clauses", "summary", "summarize", "summarise"
+]
+
+REGULATION_INTENT_WORDS = ["law", "regulation", "regulatory", "gdpr", "dpdp", "hipaa", "ccpa", "privacy"]
+# Same list regupdate precomputes per regulation; without regupdate there is nothing to match
+REGULATION_KEYWORDS = list(getattr(regupdate, "REGULATION_KEYWORDS", []))
+
+
+def _compile_substring_matcher(words: List[str]) -> re.Pattern:
+    """One compiled alternation replaces a Python loop of `w in text` checks."""
+    unique = sorted(set(words), key=len, reverse=True)
+    if not unique:
+        return re.compile(r"(?!)")  # matches nothing (an empty alternation would match everywhere)
+    return re.compile("|".join(re.escape(w) for w in unique))
+
+
+# Every short trigger ("summarize", "clauses", "analyze", ...) is already a
+# substring of one of these, so a single scan covers all three original checks.
+_CONTRACT_TRIGGER_RE = _compile_substring_matcher(CONTRACT_INTENT_PHRASES + CONTRACT_KEYWORDS)
+_REGULATION_INTENT_RE = _compile_substring_matcher(REGULATION_INTENT_WORDS)
+_REGULATION_KEYWORD_RE = _compile_substring_matcher(REGULATION_KEYWORDS)
+
+
 def is_contract_related(query: str) -> bool:
     """
     Robust detection of contract-related intent.
@@ -121,107 +247,97 @@ def is_contract_related(query: str) -> bool:
     """
     if not query:
         return False
+    return _is_contract_related_lower(query.lower())
 
-    q = query.lower().strip()
-
-    # 1) Intent phrases that clearly request contract work
-    intent_phrases = [
-        "summarize", "summary", "summarise", "summarise the", "summarize the",
-        "analyze", "analyse", "analysis", "key clauses", "key clause",
-        "give me the clauses", "list clauses", "what are the clauses",
-        "extract clauses", "what is the termination", "termination clause",
-        "termination", "indemnit", "indemnify", "indemnity",
-        "liability", "obligation", "obligations", "scope", "agreement",
-        "contract", "contractual", "rectify", "rectification", "correct this",
-        "review the contract", "review contract", "summarise contract",
-        "summarize contract", "summarise the contract", "summarize the contract",
-        "key points", "key points of the contract", "important clauses",
-        "what does the contract say", "what does this contract say",
-        "what are the key points", "contract summary", "contract analysis",
-    ]
-    for p in intent_phrases:
-        if p in q:
-            return True
-
-    # 2) Broad domain keywords (fallback)
-    keywords = [
-        "contract", "agreement", "clause", "term", "termination", "indemnity",
-        "liability", "obligation", "service", "scope", "client", "provider",
-        "party", "payment", "fees", "breach", "ip", "confidential", "governing",
-        "law", "non-compete", "risk", "clauses", "summary", "summarize", "summarise"
-    ]
-    if any(k in q for k in keywords):
-        return True
-
-    # 3) Short queries with likely intent (e.g., single word "summarize")
-    # Check for exact short words
-    short_triggers = {"summarize", "summarise", "summary", "clauses", "analyze", "analyse"}
-    q_tokens = set(q.replace("?", "").replace(".", "").split())
-    if q_tokens & short_triggers:
-        return True
-
-    return False
 
+def _is_contract_related_lower(q: str) -> bool:
+    """is_contract_related for an already-lowercased query."""
+    return _CONTRACT_TRIGGER_RE.search(q) is not None
 
 
 # -----------------------------------------
 # REGULATION SEARCH (SMART)
 # -----------------------------------------
+REG_MANIFEST_PATH = Path(__file__).parent / "regulatory_storage" / "reg_manifests.json"
+
+
+@lru_cache(maxsize=1)
+def _load_regulations_cached(path_str: str, mtime_ns: int) -> Dict[str, Any]:
+    raw = Path(path_str).read_bytes()
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+
 def load_regulations():
-    reg_path = Path(__file__).parent / "regulatory_storage" / "reg_manifests.json"
+    """Return the regulation manifest (shared, read-only; re-parsed only when the file changes)."""
+    reg_path = REG_MANIFEST_PATH
     if reg_path.exists():
         try:
-            return json.loads(reg_path.read_text(encoding="utf-8"))
+            return _load_regulations_cached(str(reg_path), reg_path.stat().st_mtime_ns)
         except:
             return {}
     return {}
 
 
+def _regulation_keywords(text_lower: str) -> set:
+    return {m.group(0) for m in _REGULATION_KEYWORD_RE.finditer(text_lower)}
+
+
 def search_regulations(query: str):
+    return _search_regulations_lower(query.lower())
+
+
+def _search_regulations_lower(q: str):
+    """search_regulations for an already-lowercased query."""
+    query_kws = _regulation_keywords(q)
+    if not query_kws:
+        return []
     regs = load_regulations()
     if not regs:
         return []
-    keywords = ["gdpr", "dpdp", "hipaa", "ccpa", "privacy", "data", "compliance", "security"]
-    if not any(k in query.lower() for k in keywords):
-        return []
 
     results = []
     for rid, data in regs.items():
-        text = (data.get("text") or "").lower()
-        for kw in keywords:
-            if kw in text:
-                snippet = data["text"][:700]
-                results.append((rid, snippet))
-                break
+        # 'keywords' / 'snippet' are precomputed by regupdate.register_regulations;
+        # older manifests fall back to scanning the text.
+        reg_kws = data.get("keywords")
+        if reg_kws is None:
+            reg_kws = _regulation_keywords((data.get("text") or "").lower())
+        if query_kws.intersection(reg_kws):
+            snippet = data.get("snippet") or (data.get("text") or "")[:700]
+            results.append((rid, snippet))
     return results[:4]
 
 
 # -----------------------------------------
 # MAIN CHAT FUNCTION
 # -----------------------------------------
-def chat_with_memory(
+HISTORY_TURNS = 8  # messages of conversation memory included in the prompt
+
+
+def format_history_line(role: str, msg: str) -> str:
+    return f"{'User' if role == 'user' else 'Assistant'}: {msg}"
+
+
+def _build_chat_messages(
     user_message: str,
     memory: List[Tuple[str, str]],
-    contract_path: Optional[str] = None
-):
+    contract_path: Optional[str] = None,
+    history_lines: Optional[Iterable[str]] = None
+) -> List[Dict[str, str]]:
 
-    # 1) Conversation memory
-    history_lines = [
-        f"{'User' if role == 'user' else 'Assistant'}: {msg}"
-        for role, msg in memory[-8:]
-    ]
-    history_text = "\n".join(history_lines) if history_lines else "(no history)"
+    # 1) Conversation memory (callers may pass lines pre-formatted with format_history_line)
+    if history_lines is None:
+        history_lines = [format_history_line(role, msg) for role, msg in memory[-HISTORY_TURNS:]]
+    history_text = "\n".join(history_lines) or "(no history)"
 
-    # 2) SMART CONTEXT ACTIVATION
-    use_contract = is_contract_related(user_message)
-    use_regulation = any(
-        w in user_message.lower()
-        for w in ["law", "regulation", "regulatory", "gdpr", "dpdp", "hipaa", "ccpa", "privacy"]
-    )
+    # 2) SMART CONTEXT ACTIVATION (lowercase once, share across all checks)
+    q_lower = user_message.lower()
+    use_contract = _is_contract_related_lower(q_lower)
+    use_regulation = _REGULATION_INTENT_RE.search(q_lower) is not None
 
     # retrieve chunks only when needed
     contract_chunks = retrieve_context_chunks(user_message, contract_path) if use_contract else []
-    regulation_chunks = search_regulations(user_message) if use_regulation else []
+    regulation_chunks = _search_regulations_lower(q_lower) if use_regulation else []
 
     # build context text
     context_blocks = []
@@ -263,10 +379,26 @@ User Query:
 Respond appropriately based on whether the question is general, contract-related, or regulation-related.
 """.strip()
 
-    # 5) CALL LLM
-    response = call_groq([
+    return [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": final_prompt}
-    ])
+    ]
+
 
-    return response
+def chat_with_memory(
+    user_message: str,
+    memory: List[Tuple[str, str]],
+    contract_path: Optional[str] = None,
+    history_lines: Optional[Iterable[str]] = None
+) -> str:
+    return call_groq(_build_chat_messages(user_message, memory, contract_path, history_lines))
+
+
+def stream_chat_with_memory(
+    user_message: str,
+    memory: List[Tuple[str, str]],
+    contract_path: Optional[str] = None,
+    history_lines: Optional[Iterable[str]] = None
+) -> Iterator[str]:
+    """Same as chat_with_memory, but yields the reply token by token (for st.write_stream)."""
+    yield from stream_groq(_build_chat_messages(user_message, memory, contract_path, history_lines))
@@ -1,21 +1,24 @@
 # mail.py
 
 import os
+import base64
+import asyncio
+import queue
 import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
-from email import encoders
 from pathlib import Path
-from typing import Optional, List
+from typing import Optional, List, Union
 
-# --- ReportLab Import ---
+# --- Optional SIMD base64 (pybase64 wraps Lemire's AVX2/SSSE3 encoder) ---
 try:
-    from reportlab.lib.pagesizes import letter
-    from reportlab.pdfgen import canvas
+    import pybase64 as _b64
 except ImportError:
-    print("❌ ReportLab not found. Please install it: pip install reportlab")
-    canvas = None
+    _b64 = base64
 
 # --- Configuration ---
 SMTP_SERVER = "smtp.gmail.com"
@@ -25,20 +28,137 @@ SENDER_EMAIL = "suryalokeshg2004@gmail.com"
 SENDER_PASSWORD = "sqdr ssqr ohvy unpc" 
 
 
+# -------------------------
+# Attachment encoding
+# -------------------------
+B64_LINE_BYTES = 57               # raw bytes per 76-char base64 line
+B64_CHUNK_BYTES = B64_LINE_BYTES * 1024
+ATTACHMENT_READ_BUFFER = 1 << 20  # 1 MiB reads from disk, sliced into encoder chunks
+
+
+def _encode_one(file_path: Path) -> MIMEBase:
+    """
+    Build a base64 PDF part, encoding the file chunk by chunk into a pre-sized buffer
+    instead of reading the whole file and re-encoding it with encoders.encode_base64.
+    """
+    size = file_path.stat().st_size
+    n_lines = (size + B64_LINE_BYTES - 1) // B64_LINE_BYTES
+    buf = bytearray(((size + 2) // 3) * 4 + n_lines)  # base64 chars + one newline per line
+    pos = 0
+    with open(file_path, "rb", buffering=ATTACHMENT_READ_BUFFER) as f:
+        while chunk := f.read(B64_CHUNK_BYTES):
+            # chunk is a whole number of lines, so the output lines are exactly 76 chars
+            enc = _b64.encodebytes(chunk)
+            buf[pos:pos + len(enc)] = enc
+            pos += len(enc)
+    del buf[pos:]  # no-op unless the file shrank while reading
+
+    part = MIMEBase("application", "pdf")
+    part.set_payload(buf.decode("ascii"))
+    part["Content-Transfer-Encoding"] = "base64"
+    part.add_header(
+        "Content-Disposition",
+        f"attachment; filename={file_path.name}",
+    )
+    return part
+
+
+def _encode_attachments(file_paths: List[Path]) -> List[Optional[MIMEBase]]:
+    """
+    Encode several attachments concurrently (disk reads overlap, and the encoder can
+    run on other cores where it releases the GIL). Returns one part per path, in
+    order, with None for files that failed.
+    """
+    def _safe_encode(file_path: Path) -> Optional[MIMEBase]:
+        try:
+            return _encode_one(file_path)
+        except Exception as e:
+            print(f"❌ Could not attach {file_path.name}: {e}")
+            return None
+
+    if len(file_paths) <= 1:
+        return [_safe_encode(p) for p in file_paths]
+    with ThreadPoolExecutor(max_workers=min(len(file_paths), os.cpu_count() or 4)) as ex:
+        return list(ex.map(_safe_encode, file_paths))
+
+
+# -------------------------
+# 0) Reusable SMTP connection
+# -------------------------
+class SmtpPool:
+    """
+    Keeps one authenticated SMTP connection open for several messages:
+
+        with SmtpPool() as pool:
+            for r in recipients:
+                send_compliance_update_email(r, ..., session=pool)
+
+    Saves the TCP connect, STARTTLS handshake and AUTH round-trips per message.
+    """
+
+    def __init__(
+        self,
+        server: str = SMTP_SERVER,
+        port: int = SMTP_PORT,
+        sender: str = SENDER_EMAIL,
+        password: str = SENDER_PASSWORD,
+    ):
+        self.server = server
+        self.port = port
+        self.sender = sender
+        self.password = password
+        self._smtp: Optional[smtplib.SMTP] = None
+
+    def __enter__(self) -> "SmtpPool":
+        self._smtp = smtplib.SMTP(self.server, self.port)
+        try:
+            self._smtp.starttls()
+            self._smtp.login(self.sender, self.password)
+        except Exception:
+            self._smtp.close()
+            self._smtp = None
+            raise
+        return self
+
+    def send(self, msg: MIMEMultipart, to):
+        if self._smtp is None:
+            raise RuntimeError("SmtpPool is not connected; use it as a context manager.")
+        # send_message serializes through a BytesGenerator instead of building one
+        # giant str of the whole message (attachments included) first
+        self._smtp.send_message(msg, from_addr=self.sender, to_addrs=to)
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except smtplib.SMTPException:
+            self._smtp.close()
+        finally:
+            self._smtp = None
+
+
 # -------------------------
 # 1) Specific helper for contract updates (Now supports MULTIPLE files)
 # -------------------------
-def send_compliance_update_email(
-    recipient_email: str,
+def _build_compliance_update_message(
+    recipient_email: Union[str, List[str]],
     contract_title: str,
     regulation_name: str,
     new_version: str,
-    attachments: List[Path],  # CHANGED: Accepts a list of paths
+    attachments: List[Path],
 ):
     """
-    Sends an email with MULTIPLE attachments (Analysis PDF + Rectified Contract PDF).
+    Builds the update message. Returns (msg, recipients, attached_count), or None
+    (after printing why) when there is no recipient or no valid attachment.
     """
-    
+    if isinstance(recipient_email, str):
+        recipient_email = [recipient_email]
+    recipients = list(dict.fromkeys(r.strip() for r in recipient_email if r and r.strip()))
+    if not recipients:
+        print("❌ Error: No recipients given. Email not sent.")
+        return None
+
     # Filter out non-existent or empty files
     valid_files = []
     for p in attachments:
@@ -49,7 +169,7 @@ def send_compliance_update_email(
 
     if not valid_files:
         print("❌ Error: No valid files to attach. Email not sent.")
-        return
+        return None
 
     subject = f"Regulatory Update: '{contract_title}' (Reg: {regulation_name}) 🤖"
 
@@ -77,44 +197,213 @@ AI Compliance Bot
 
     msg = MIMEMultipart()
     msg["From"] = SENDER_EMAIL
-    msg["To"] = recipient_email
+    msg["To"] = ", ".join(recipients)
     msg["Subject"] = subject
 
     msg.attach(MIMEText(body, "plain"))
 
-    # Attach all valid files
-    for file_path in valid_files:
-        try:
-            with open(file_path, "rb") as f:
-                part = MIMEBase("application", "pdf")
-                part.set_payload(f.read())
-            
-            encoders.encode_base64(part)
-            part.add_header(
-                "Content-Disposition",
-                f"attachment; filename={file_path.name}",
-            )
+    # Attach all valid files (encoded in parallel, attached in order)
+    for part in _encode_attachments(valid_files):
+        if part is not None:
             msg.attach(part)
-        except Exception as e:
-            print(f"❌ Could not attach {file_path.name}: {e}")
+
+    return msg, recipients, len(valid_files)
+
+
+def send_compliance_update_email(
+    recipient_email: Union[str, List[str]],
+    contract_title: str,
+    regulation_name: str,
+    new_version: str,
+    attachments: List[Path],  # CHANGED: Accepts a list of paths
+    session: Optional[SmtpPool] = None,
+):
+    """
+    Sends an email with MULTIPLE attachments (Analysis PDF + Rectified Contract PDF).
+    `recipient_email` may be a list: the message is built and transmitted once with one
+    RCPT TO per recipient (use send_compliance_update_emails for separate copies).
+    Pass an open SmtpPool as `session` to reuse its connection instead of opening one.
+    """
+    built = _build_compliance_update_message(
+        recipient_email, contract_title, regulation_name, new_version, attachments
+    )
+    if built is None:
+        return
+    msg, recipients, n_files = built
+    to_header = msg["To"]
 
     try:
-        if SENDER_PASSWORD:
-            print(f"   📧 Connecting to SMTP server to send to {recipient_email}...")
-            server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-            server.starttls()
-            server.login(SENDER_EMAIL, SENDER_PASSWORD)
-            server.sendmail(SENDER_EMAIL, recipient_email, msg.as_string())
-            server.quit()
+        if session is not None:
+            print(f"   📧 Sending to {to_header} over the open SMTP session...")
+            session.send(msg, recipients)
+            print("   ✅ Email sent successfully with all attachments!")
+        elif SENDER_PASSWORD:
+            print(f"   📧 Connecting to SMTP server to send to {to_header}...")
+            with SmtpPool() as pool:
+                pool.send(msg, recipients)
             print("   ✅ Email sent successfully with all attachments!")
         else:
             print("   ⚠️ Email not sent: SENDER_PASSWORD is not set.")
-            print(f"   (Simulated send to {recipient_email} with {len(valid_files)} attachments)")
+            print(f"   (Simulated send to {to_header} with {n_files} attachments)")
 
     except Exception as e:
         print(f"   ❌ Failed to send email: {e}")
 
 
+async def send_compliance_update_email_async(
+    recipient_email: str,
+    contract_title: str,
+    regulation_name: str,
+    new_version: str,
+    attachments: List[Path],
+):
+    """
+    Awaitable version of send_compliance_update_email. The blocking SMTP exchange runs
+    in a worker thread, so several sends (connect, TLS, AUTH, DATA) overlap.
+    """
+    await asyncio.to_thread(
+        send_compliance_update_email,
+        recipient_email,
+        contract_title,
+        regulation_name,
+        new_version,
+        attachments,
+    )
+
+
+def send_compliance_update_emails(
+    recipients: List[str],
+    contract_title: str,
+    regulation_name: str,
+    new_version: str,
+    attachments: List[Path],
+):
+    """
+    Sends a separate copy of the update to each recipient, concurrently.
+    Wall time is roughly one SMTP round-trip chain instead of one per recipient.
+    When recipients may share one message, pass the list to send_compliance_update_email
+    instead: attachments are then encoded and transmitted only once.
+    """
+    async def _send_all():
+        await asyncio.gather(*[
+            send_compliance_update_email_async(r, contract_title, regulation_name, new_version, attachments)
+            for r in recipients
+        ])
+
+    asyncio.run(_send_all())
+
+
+# -------------------------
+# 1b) Background outbox
+# -------------------------
+EMAIL_QUEUE_BATCH_SIZE = 16   # messages sent per SMTP connection
+EMAIL_MAX_ATTEMPTS = 3
+EMAIL_RETRY_DELAY = 5.0       # seconds to wait before retrying a failed batch
+
+_OUTBOX: "queue.Queue[dict]" = queue.Queue()
+_OUTBOX_WORKER: Optional[threading.Thread] = None
+_OUTBOX_LOCK = threading.Lock()
+
+
+def _send_outbox_batch(batch: List[dict]) -> List[dict]:
+    """Sends a batch over one SMTP connection. Returns the jobs that should be retried."""
+    built = []
+    for job in batch:
+        b = _build_compliance_update_message(
+            job["recipient_email"], job["contract_title"], job["regulation_name"],
+            job["new_version"], job["attachments"],
+        )
+        if b is not None:
+            built.append((job, b))
+    if not built:
+        return []
+
+    if not SENDER_PASSWORD:
+        for _, (msg, _, n_files) in built:
+            print("   ⚠️ Email not sent: SENDER_PASSWORD is not set.")
+            print(f"   (Simulated send to {msg['To']} with {n_files} attachments)")
+        return []
+
+    retry = []
+    try:
+        with SmtpPool() as pool:
+            for i, (job, (msg, recipients, _)) in enumerate(built):
+                try:
+                    pool.send(msg, recipients)
+                    print(f"   ✅ Queued email sent to {msg['To']}")
+                except smtplib.SMTPServerDisconnected as e:
+                    print(f"   ❌ SMTP connection lost: {e}")
+                    retry.extend(j for j, _ in built[i:])
+                    break
+                except smtplib.SMTPException as e:
+                    print(f"   ❌ Failed to send queued email to {msg['To']}: {e}")
+                    retry.append(job)
+    except (OSError, smtplib.SMTPException) as e:
+        # Connect / STARTTLS / AUTH failed: nothing in the batch went out
+        print(f"   ❌ Could not open SMTP session: {e}")
+        retry = [job for job, _ in built]
+    return retry
+
+
+def _outbox_worker():
+    while True:
+        batch = [_OUTBOX.get()]
+        while len(batch) < EMAIL_QUEUE_BATCH_SIZE:
+            try:
+                batch.append(_OUTBOX.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            retry = _send_outbox_batch(batch)
+        except Exception as e:
+            print(f"   ❌ Email worker error: {e}")
+            retry = []
+        if retry:
+            time.sleep(EMAIL_RETRY_DELAY)
+            for job in retry:
+                job["attempts"] += 1
+                if job["attempts"] < EMAIL_MAX_ATTEMPTS:
+                    _OUTBOX.put(job)
+                else:
+                    print(f"   ❌ Giving up on email to {job['recipient_email']} "
+                          f"after {EMAIL_MAX_ATTEMPTS} attempts.")
+        for _ in batch:
+            _OUTBOX.task_done()
+
+
+def enqueue_compliance_update_email(
+    recipient_email: Union[str, List[str]],
+    contract_title: str,
+    regulation_name: str,
+    new_version: str,
+    attachments: List[Path],
+):
+    """
+    Non-blocking send_compliance_update_email: the message is built and sent by a
+    background thread that batches queued messages over one SMTP connection and
+    retries on SMTP errors. Call flush_email_queue() before a script exits, since
+    the worker is a daemon thread.
+    """
+    global _OUTBOX_WORKER
+    with _OUTBOX_LOCK:
+        if _OUTBOX_WORKER is None or not _OUTBOX_WORKER.is_alive():
+            _OUTBOX_WORKER = threading.Thread(target=_outbox_worker, name="mail-outbox", daemon=True)
+            _OUTBOX_WORKER.start()
+    _OUTBOX.put({
+        "recipient_email": recipient_email,
+        "contract_title": contract_title,
+        "regulation_name": regulation_name,
+        "new_version": new_version,
+        "attachments": list(attachments),
+        "attempts": 0,
+    })
+
+
+def flush_email_queue():
+    """Blocks until every queued email has been sent or given up on."""
+    _OUTBOX.join()
+
+
 # -------------------------
 # 2) Generic helper (Keep as is)
 # -------------------------
@@ -133,6 +422,14 @@ def send_reg_update_email(user_email: Optional[str], updated_files: List[str], l
 # SELF-TEST BLOCK (Updated for Multiple Files)
 # -------------------------
 if __name__ == "__main__":
+    # --- ReportLab Import (only the self-test draws PDFs) ---
+    try:
+        from reportlab.lib.pagesizes import letter
+        from reportlab.pdfgen import canvas
+    except ImportError:
+        print("❌ ReportLab not found. Please install it: pip install reportlab")
+        canvas = None
+
     print("--- Running Mail System Self-Test (Multiple Attachments) ---")
     
     # Generate Dummy File 1: Analysis
@@ -0,0 +1,37 @@
+# pdfium_text.py
+
+"""
+Shared pypdfium2 (PDFium, C++) text extraction for rag.py and regulatory/regupdate.py.
+
+PDFium is not thread-safe, and Streamlit runs rag, chatbot and regupdate in the same
+process, so every pypdfium2 call in the project must go through the one PDFIUM_LOCK
+defined here.
+"""
+
+import threading
+
+PDFIUM_LOCK = threading.Lock()
+
+
+def extract_pages_pdfium(path: str):
+    """
+    Per-page text via pypdfium2, several times faster than pypdf.
+    Returns None if pypdfium2 is not installed.
+    """
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        return None
+
+    with PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(path)
+        try:
+            pages = []
+            for page in pdf:
+                textpage = page.get_textpage()
+                pages.append(textpage.get_text_range())
+                textpage.close()
+                page.close()
+            return pages
+        finally:
+            pdf.close()
@@ -1,25 +1,20 @@
 # main.py
 
+import hashlib
+import io
 import os
+import re
 import sys
+from functools import lru_cache
 from pathlib import Path
 from dotenv import load_dotenv
 
-# --- LangChain imports ---
-from langchain_community.document_loaders import TextLoader, PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.embeddings.huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_groq import ChatGroq
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnableParallel, RunnablePassthrough
+# PDFium extraction and its process-wide lock are shared with regupdate.py
+from pdfium_text import extract_pages_pdfium as _extract_pages_pdfium
 
-# --- Extra utility (from your old loader) ---
-from pypdf import PdfReader
-
-# --- PDF writing for rectified output ---
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
+# Heavy dependencies (LangChain, torch via sentence-transformers, FAISS, pypdf,
+# ReportLab) are imported inside the functions that use them, so importing this
+# module (e.g. from regupdate.py or for extract_rectified_section) stays cheap.
 
 # Load environment variables
 load_dotenv()
@@ -28,16 +23,38 @@ if not os.getenv("GROQ_API_KEY"):
 
 MODEL_NAME = "llama-3.1-8b-instant"
 TEMPERATURE = 0.5
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBED_BATCH_SIZE_CPU = 64
+EMBED_BATCH_SIZE_GPU = 128
+ANALYSIS_TOP_K = 6  # chunks retrieved as context for the analysis prompt
+SPLIT_CHUNK_TOKENS = 256  # MiniLM truncates inputs beyond 256 tokens
+SPLIT_OVERLAP_TOKENS = 48
+HNSW_MIN_CHUNKS = 1000  # above this, use an HNSW graph instead of a linear scan
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64  # >= the chatbot's rerank candidate count
 
 PROJECT_ROOT = Path(__file__).resolve().parent
 CONTRACT_VERSIONS_DIR = PROJECT_ROOT / "regulatory_storage" / "contract_versions_pdf"
 CONTRACT_VERSIONS_DIR.mkdir(parents=True, exist_ok=True)
+FAISS_CACHE_DIR = PROJECT_ROOT / "regulatory_storage" / "faiss_cache"
+RERANK_VECTORS_FILE = "rerank_vectors.npy"  # float32 embeddings saved beside index.faiss
 
 
 # ---------- Optional PDF utility (from your loader) ----------
 def extract_pdf_pypdf(path: str) -> str:
-    """Extract text from a PDF file using pypdf (not used in main pipeline, kept for completeness)."""
+    """Extract text from a PDF file using pypdfium2, falling back to pypdf
+    (not used in main pipeline, kept for completeness)."""
+    try:
+        pages = _extract_pages_pdfium(path)
+        if pages is not None:
+            return "\n".join(text for text in pages if text)
+    except Exception:
+        pass  # let pypdf have a go at PDFs PDFium rejects
+
     try:
+        from pypdf import PdfReader
+
         reader = PdfReader(path)
         pages = []
         for p in reader.pages:
@@ -67,44 +84,210 @@ def load_multiple_pdfs(file_paths):
 
 
 # ---------- Step 1: Read contract file ----------
+def _load_pdf_pdfium(file_path: str):
+    """One Document per page (same shape as PyPDFLoader), or [] if PDFium is unavailable."""
+    from langchain_core.documents import Document
+
+    try:
+        pages = _extract_pages_pdfium(file_path)
+    except Exception:
+        return []
+    if pages is None:
+        return []
+    return [
+        Document(page_content=text, metadata={"source": file_path, "page": i})
+        for i, text in enumerate(pages)
+    ]
+
+
 def read_contract_file(file_path: str):
     """Load and read the contract file (.pdf or .txt/.md) using LangChain loaders."""
+    from langchain_community.document_loaders import TextLoader, PyPDFLoader, PyMuPDFLoader
+
     ext = Path(file_path).suffix.lower()
     if ext == ".pdf":
-        loader = PyPDFLoader(file_path)
+        # PyMuPDF and PDFium extract text much faster than pypdf; fall back per file
+        # if they are missing or cannot parse the PDF.
+        try:
+            docs = PyMuPDFLoader(file_path).load()
+        except Exception:
+            docs = _load_pdf_pdfium(file_path) or PyPDFLoader(file_path).load()
     elif ext in {".txt", ".md"}:
-        loader = TextLoader(file_path, encoding="utf-8")
+        docs = TextLoader(file_path, encoding="utf-8").load()
     else:
         raise ValueError("Unsupported file format. Use PDF, TXT, or MD.")
-    docs = loader.load()
     print(f"✅ Loaded {len(docs)} pages from {file_path}")
     return docs
 
 
 # ---------- Step 2: Build vector index ----------
+def _embedding_device() -> str:
+    """Pick the fastest available torch device for the embedding forward pass."""
+    import torch  # installed with sentence-transformers
+
+    if torch.cuda.is_available():
+        return "cuda"
+    mps = getattr(torch.backends, "mps", None)
+    if mps is not None and mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+@lru_cache(maxsize=1)
+def _get_embeddings(model_name: str = EMBEDDING_MODEL):
+    """Load the sentence-transformer once per process and reuse it for every index."""
+    from langchain_community.embeddings.huggingface import HuggingFaceEmbeddings
+
+    device = _embedding_device()
+    embeddings = HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs={"device": device},
+        # Unit-length embeddings make inner product == cosine similarity
+        encode_kwargs={
+            "normalize_embeddings": True,
+            "batch_size": EMBED_BATCH_SIZE_GPU if device != "cpu" else EMBED_BATCH_SIZE_CPU,
+        },
+    )
+    if device == "cuda":
+        embeddings.client.half()  # FP16 weights: ~2x matmul throughput on GPU
+    return embeddings
+
+
+@lru_cache(maxsize=1)
+def _get_splitter():
+    """
+    Token-based splitter backed by tiktoken's Rust tokenizer (encoder loaded once).
+    Chunks stay within MiniLM's 256-token input window. Falls back to the character
+    splitter if tiktoken is not installed.
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter, TokenTextSplitter
+
+    try:
+        return TokenTextSplitter(
+            encoding_name="cl100k_base",
+            chunk_size=SPLIT_CHUNK_TOKENS,
+            chunk_overlap=SPLIT_OVERLAP_TOKENS,
+        )
+    except ImportError:
+        return RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+
+
+def _split_documents(docs):
+    return _get_splitter().split_documents(docs)
+
+
 def build_vector_index(docs):
     """Split contract text and create FAISS vector index using embeddings."""
-    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    chunks = splitter.split_documents(docs)
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    vector_store = FAISS.from_documents(chunks, embeddings)
-    return vector_store
+    return _index_chunks(_split_documents(docs))
 
 
-# ---------- Step 3: Create analysis pipeline ----------
-def create_analysis_pipeline(vector_store):
-    """Build the RAG pipeline for full contract analysis."""
-    retriever = vector_store.as_retriever(search_kwargs={"k": 6})
+def _index_cache_key(chunks) -> str:
+    """
+    SHA-256 over the chunk texts/metadata plus every setting that shapes the index,
+    so a changed contract, splitter, model or quantizer never reuses a stale index.
+    """
+    h = hashlib.sha256()
+    config = (EMBEDDING_MODEL, SPLIT_CHUNK_TOKENS, SPLIT_OVERLAP_TOKENS,
+              HNSW_MIN_CHUNKS, HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH, "flat|hnsw-sq8+f32")
+    h.update(repr(config).encode("utf-8"))
+    for chunk in chunks:
+        h.update(b"\0")
+        h.update(repr(sorted(chunk.metadata.items())).encode("utf-8"))
+        h.update(b"\0")
+        h.update(chunk.page_content.encode("utf-8"))
+    return h.hexdigest()
+
+
+def _index_chunks(chunks):
+    """
+    Embed and index the chunks, persisting the result under faiss_cache/<sha256>.
+    Re-analysing a contract seen before (app reruns, regupdate.py) loads the saved
+    index instead of repeating the embedding pass.
+    """
+    from langchain_community.vectorstores import FAISS
+    from langchain_community.vectorstores.utils import DistanceStrategy
 
-    llm = ChatGroq(
-        api_key=os.getenv("GROQ_API_KEY"),
-        model_name=MODEL_NAME,
-        temperature=TEMPERATURE,
-        max_tokens=1800,
+    embeddings = _get_embeddings()
+    cache_path = FAISS_CACHE_DIR / _index_cache_key(chunks)
+    if (cache_path / "index.faiss").exists():
+        try:
+            import numpy as np
+
+            # The pickle is only ever written by save_local below, never user-supplied
+            vector_store = FAISS.load_local(
+                str(cache_path),
+                embeddings,
+                allow_dangerous_deserialization=True,
+                distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+            )
+            rerank_path = cache_path / RERANK_VECTORS_FILE
+            if rerank_path.exists():
+                vector_store.rerank_vectors = np.load(rerank_path, mmap_mode="r")
+            return vector_store
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable FAISS cache {cache_path.name}: {e}")
+
+    vector_store = FAISS.from_documents(
+        chunks, embeddings, distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
     )
+    _quantize_index(vector_store)
+    try:
+        import numpy as np
+
+        vector_store.save_local(str(cache_path))
+        if getattr(vector_store, "rerank_vectors", None) is not None:
+            # Swap the in-RAM float32 copy for a page-cache-backed view of the saved file
+            rerank_path = cache_path / RERANK_VECTORS_FILE
+            np.save(rerank_path, vector_store.rerank_vectors)
+            vector_store.rerank_vectors = np.load(rerank_path, mmap_mode="r")
+    except Exception as e:
+        print(f"⚠️ Could not cache FAISS index: {e}")
+    return vector_store
+
+
+def _quantize_index(vector_store):
+    """
+    Contracts above HNSW_MIN_CHUNKS get an HNSW graph over int8 scalar-quantized
+    vectors, so search is sub-linear in chunk count. Smaller ones keep the exact
+    float32 IndexFlatIP (no quantization error, nothing to rerank).
+
+    SQ8 scores carry quantization error, so for the HNSW case the float32 embeddings
+    are kept as `vector_store.rerank_vectors` (row i = index position i; memory-mapped
+    from the FAISS cache once saved). The chatbot rescores oversampled candidates
+    against them (chatbot._rerank_search).
+    """
+    flat = vector_store.index
+    if flat.ntotal <= HNSW_MIN_CHUNKS:
+        return
+
+    import faiss
 
-    prompt = ChatPromptTemplate.from_template(
-        """
+    vectors = flat.reconstruct_n(0, flat.ntotal)
+    index = faiss.IndexHNSWSQ(flat.d, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    index.train(vectors)
+    index.add(vectors)
+    vector_store.index = index
+    vector_store.rerank_vectors = vectors
+
+
+def build_analysis_retriever(docs, k: int = ANALYSIS_TOP_K):
+    """
+    Retriever for the analysis chain. When the contract splits into k chunks or fewer,
+    similarity search could not prune anything, so skip embedding/indexing and hand
+    back all chunks.
+    """
+    from langchain_core.runnables import RunnableLambda
+
+    chunks = _split_documents(docs)
+    if len(chunks) <= k:
+        return RunnableLambda(lambda _query: chunks)
+    return _index_chunks(chunks).as_retriever(search_kwargs={"k": k})
+
+
+# ---------- Step 3: Create analysis pipeline ----------
+ANALYSIS_PROMPT_TEMPLATE = """
 You are a senior legal compliance expert specializing in contract law.
 Given the extracted contract text below, perform these tasks in a structured way:
 
@@ -137,13 +320,42 @@ Context:
 
 Question:
 Analyze and rectify this contract for completeness, clause strength, and compliance.
-        """
+"""
+
+
+@lru_cache(maxsize=1)
+def _get_prompt():
+    """Parse the analysis prompt once per process."""
+    from langchain_core.prompts import ChatPromptTemplate
+
+    return ChatPromptTemplate.from_template(ANALYSIS_PROMPT_TEMPLATE)
+
+
+@lru_cache(maxsize=1)
+def _get_llm():
+    """One ChatGroq client per process, so its HTTP connection pool is reused across analyses."""
+    from langchain_groq import ChatGroq
+
+    return ChatGroq(
+        api_key=os.getenv("GROQ_API_KEY"),
+        model_name=MODEL_NAME,
+        temperature=TEMPERATURE,
+        max_tokens=1800,
     )
 
+
+def create_analysis_pipeline(retriever):
+    """Build the RAG pipeline for full contract analysis.
+    Takes a retriever (see build_analysis_retriever); a vector store is also accepted."""
+    from langchain_core.runnables import RunnableParallel, RunnablePassthrough
+
+    if hasattr(retriever, "as_retriever"):
+        retriever = retriever.as_retriever(search_kwargs={"k": ANALYSIS_TOP_K})
+
     analysis_chain = (
         RunnableParallel({"context": retriever, "question": RunnablePassthrough()})
-        | prompt
-        | llm
+        | _get_prompt()
+        | _get_llm()
     )
     return analysis_chain
 
@@ -165,6 +377,9 @@ def analyze_contract(chain, echo: bool = True) -> str:
 
 
 # ---------- Helper: extract rectified contract & save to PDF ----------
+_RECTIFIED_MARKER_RE = re.compile(r"RECTIFIED CONTRACT VERSION:", re.IGNORECASE)
+
+
 def extract_rectified_section(output_text: str) -> str:
     """
     Extract the 'RECTIFIED CONTRACT VERSION' section from the model output.
@@ -172,12 +387,12 @@ def extract_rectified_section(output_text: str) -> str:
     """
     if not output_text:
         return ""
-    marker = "RECTIFIED CONTRACT VERSION:"
-    idx = output_text.upper().find(marker)
-    if idx == -1:
+    # Case-insensitive search without building an uppercased copy of the output
+    m = _RECTIFIED_MARKER_RE.search(output_text)
+    if not m:
         return ""
     # Take everything after marker
-    section = output_text[idx + len(marker) :]
+    section = output_text[m.end() :]
     return section.strip()
 
 
@@ -194,7 +409,12 @@ def save_rectified_as_pdf(rectified_text: str, original_path: str) -> str:
     base_name = Path(original_path).stem
     out_path = CONTRACT_VERSIONS_DIR / f"{base_name}_RECTIFIED_{ts}.pdf"
 
-    c = canvas.Canvas(str(out_path), pagesize=letter)
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    # Render in memory and write the finished PDF with a single write
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=letter, pageCompression=1)
     width, height = letter
     y = height - 40
 
@@ -203,22 +423,19 @@ def save_rectified_as_pdf(rectified_text: str, original_path: str) -> str:
     y -= 28
     c.setFont("Helvetica", 10)
 
-    for line in rectified_text.splitlines():
-        line = line.rstrip("\n")
-        while len(line) > 120:
-            c.drawString(40, y, line[:120])
-            line = line[120:]
+    lines = rectified_text.splitlines()
+    for line in lines:
+        # Slice each long line into 120-char segments in one pass (no repeated re-slicing)
+        segments = [line[i:i + 120] for i in range(0, len(line), 120)] or [""]
+        for segment in segments:
+            c.drawString(40, y, segment)
             y -= 12
             if y < 40:
                 c.showPage()
                 y = height - 40
-        c.drawString(40, y, line)
-        y -= 12
-        if y < 40:
-            c.showPage()
-            y = height - 40
 
     c.save()
+    out_path.write_bytes(buf.getvalue())
     return str(out_path.resolve())
 # --- rag.py ---
 
@@ -245,10 +462,10 @@ def run_rectification_pipeline(file_path: str) -> str:
         return ""
 
     # 2. Index
-    vector_index = build_vector_index(docs)
+    retriever = build_analysis_retriever(docs)
 
     # 3. Analyze
-    chain = create_analysis_pipeline(vector_index)
+    chain = create_analysis_pipeline(retriever)
     output = analyze_contract(chain, echo=False)
 
     # 4. Extract & Save
@@ -280,10 +497,10 @@ if __name__ == "__main__":
     documents = read_contract_file(file_path)
 
     # Step 2: Build index
-    vector_index = build_vector_index(documents)
+    retriever = build_analysis_retriever(documents)
 
     # Step 3: Create pipeline
-    analysis_chain = create_analysis_pipeline(vector_index)
+    analysis_chain = create_analysis_pipeline(retriever)
 
     if non_interactive:
         # Called by regupdate.py → run once, save rectified PDF, print path
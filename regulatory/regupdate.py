@@ -9,17 +9,33 @@ Integrates with:
 
 import os
 import sys
+import hashlib
+import io
 import json
+import logging
 import re
-import difflib
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from datetime import datetime, timezone
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
-import requests
-from pypdf import PdfReader
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
+
+# Optional: orjson for the manifest files
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional: selectolax (C HTML parser) for the SPDI page
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None
+
+logger = logging.getLogger("regupdate")
 
 # -------------------------------------------------------------------
 # 1. Project Path Setup (Crucial for importing rag/mail from root)
@@ -31,6 +47,9 @@ PROJECT_ROOT = CURRENT_FILE.parent.parent
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.append(str(PROJECT_ROOT))
 
+# PDFium text extraction; its lock is shared with rag.py (PDFium is not thread-safe)
+from pdfium_text import extract_pages_pdfium
+
 BASE_DIR = PROJECT_ROOT
 
 # Define directories
@@ -45,6 +64,11 @@ LOGS_DIR = STORAGE_DIR / "logs"
 
 REG_MANIFESTS_JSON = STORAGE_DIR / "reg_manifests.json"        
 CONTRACT_MANIFESTS_JSON = STORAGE_DIR / "contract_manifests.json"
+# Full regulation texts, one file per regulation (the manifest stores the path)
+REG_TEXTS_DIR = STORAGE_DIR / "reg_texts"
+# ETag / Last-Modified per source URL. Kept out of reg_manifests.json, whose
+# top-level entries are all read as regulations.
+REG_HTTP_CACHE_JSON = STORAGE_DIR / "reg_http_cache.json"
 
 # Create directories if they don't exist
 for d in (
@@ -52,6 +76,7 @@ for d in (
     REG_DIR,
     CONTRACT_DIR,
     REG_SNAPSHOTS_DIR,
+    REG_TEXTS_DIR,
     CONTRACT_VERSIONS_DIR,
     SUGGESTIONS_DIR,
     LOGS_DIR,
@@ -62,24 +87,29 @@ for d in (
 # -------------------------------------------------------------------
 # 2. RAG AI Integration (Importing from root/rag.py)
 # -------------------------------------------------------------------
-try:
-    from rag import run_rectification_pipeline
-    RAG_AVAILABLE = True
-    print(f"✅ [regupdate] Connected to RAG system at {PROJECT_ROOT / 'rag.py'}")
-except ImportError as e:
-    print(f"\n[regupdate] ⚠️ Warning: Could not import 'rag.py'. Details: {e}")
-    print("             Make sure 'rag.py' is in the project root folder.")
-    RAG_AVAILABLE = False
+# Imported on first use: the CLI's listing options never need it.
+@lru_cache(maxsize=1)
+def _rectification_pipeline():
+    """rag.run_rectification_pipeline, or None if rag.py cannot be imported.
+    rag raises SystemExit at import when GROQ_API_KEY is unset; that also falls
+    back to suggestions only instead of ending the CLI mid-run."""
+    try:
+        from rag import run_rectification_pipeline
+    except (ImportError, SystemExit) as e:
+        logger.warning("[regupdate] ⚠️ Could not import 'rag.py' (make sure it is in the project root folder). Details: %s", e)
+        return None
+    logger.info("✅ [regupdate] Connected to RAG system at %s", PROJECT_ROOT / "rag.py")
+    return run_rectification_pipeline
 
 
 # -------------------------------------------------------------------
 # 3. Email Integration (Importing from root/mail.py)
 # -------------------------------------------------------------------
 try:
-    from mail import send_compliance_update_email
+    from mail import send_compliance_update_email, enqueue_compliance_update_email, flush_email_queue
 except ImportError as e:
-    print(f"\n[regupdate] ⚠️ Warning: could not import mail.send_compliance_update_email: {e}")
-    
+    logger.warning("[regupdate] ⚠️ Could not import mail.send_compliance_update_email: %s", e)
+
     # Fallback stub if mail.py is missing
     def send_compliance_update_email(
         recipient_email: str,
@@ -87,6 +117,7 @@ except ImportError as e:
         regulation_name: str,
         new_version: str,
         attachments: List[Path],
+        session=None,
     ):
         print(f"\n[regupdate] (Stub) Sending simulated email to {recipient_email}")
         print(f"            Subject: Update for {contract_title}")
@@ -94,6 +125,11 @@ except ImportError as e:
         for p in attachments:
             print(f"              - {p.name}")
 
+    enqueue_compliance_update_email = send_compliance_update_email
+
+    def flush_email_queue():
+        pass
+
 
 # -------------------------------------------------------------------
 # Small helpers
@@ -106,32 +142,122 @@ def utc_timestamp() -> str:
     return datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
 
 
+def _json_loads(raw: bytes):
+    """Parse JSON bytes with orjson when available (stdlib fallback)."""
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+
+def _json_dumps(data) -> bytes:
+    if orjson:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, indent=2).encode("utf-8")
+
+
+def _json_stamp(path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
 def load_json(path: Path) -> Dict:
     if not path.exists():
         return {}
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return _json_loads(path.read_bytes())
     except Exception as e:
-        print(f"[regupdate] Warning: failed to load JSON from {path}: {e}")
+        logger.warning("[regupdate] Failed to load JSON from %s: %s", path, e)
         return {}
 
 
 def save_json(path: Path, data: Dict):
     try:
         path.parent.mkdir(parents=True, exist_ok=True)
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
+        path.write_bytes(_json_dumps(data))
     except Exception as e:
-        print(f"[regupdate] Error: failed to save JSON to {path}: {e}")
+        logger.error("[regupdate] Failed to save JSON to %s: %s", path, e)
+
+
+# Short ASCII log entries skip ReportLab: within these limits the entry always fits
+# on one page, so it is written as a fixed minimal PDF with only the text varying.
+LOG_PDF_FAST_MAX_CHARS = 4096
+LOG_PDF_FAST_MAX_LINES = 30
+
+# Objects 1-3, 5, 6 never change; object 4 (the content stream) is appended per entry
+_LOG_PDF_OBJECTS = [
+    (1, b"<< /Type /Catalog /Pages 2 0 R >>"),
+    (2, b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>"),
+    (3, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R "
+        b"/Resources << /Font << /F1 5 0 R /F2 6 0 R >> >> >>"),
+    (5, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"),
+    (6, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>"),
+]
+_LOG_PDF_HEAD = b"%PDF-1.4\n"
+_LOG_PDF_OFFSETS: Dict[int, int] = {}
+for _num, _body in _LOG_PDF_OBJECTS:
+    _LOG_PDF_OFFSETS[_num] = len(_LOG_PDF_HEAD)
+    _LOG_PDF_HEAD += b"%d 0 obj\n%s\nendobj\n" % (_num, _body)
+
+
+def _pdf_escape(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _log_pdf_bytes(text: str, title: str) -> Optional[bytes]:
+    """Same layout as _text_to_pdf, hand-assembled; None if the entry needs ReportLab."""
+    if len(text) > LOG_PDF_FAST_MAX_CHARS or not (text.isascii() and title.isascii()):
+        return None
+    raw_lines = text.splitlines()
+    if len(raw_lines) > LOG_PDF_FAST_MAX_LINES:
+        return None
+
+    ops = [f"BT /F2 14 Tf 40 752 Td ({_pdf_escape(title)}) Tj ET", "BT /F1 9 Tf 11 TL 40 724 Td"]
+    for line in raw_lines:
+        for segment in [line[i:i + 140] for i in range(0, len(line), 140)] or [""]:
+            ops.append(f"({_pdf_escape(segment)}) Tj T*")
+    ops.append("ET")
+    stream = "\n".join(ops).encode("ascii")
+
+    out = bytearray(_LOG_PDF_HEAD)
+    offsets = dict(_LOG_PDF_OFFSETS)
+    offsets[4] = len(out)
+    out += b"4 0 obj\n<< /Length %d >>\nstream\n%s\nendstream\nendobj\n" % (len(stream), stream)
+    xref_at = len(out)
+    out += b"xref\n0 7\n0000000000 65535 f \n"
+    for num in range(1, 7):
+        out += b"%010d 00000 n \n" % offsets[num]
+    out += b"trailer\n<< /Size 7 /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % xref_at
+    return bytes(out)
+
+
+def _reserve_log_path(prefix: str, ts: str) -> Path:
+    """
+    Claim a fresh log file name. Concurrent callers in the same second (e.g. the
+    download_error entries of fetch_all_regulations' threads) get _1, _2, ...
+    suffixes; the exclusive create makes the claim atomic.
+    """
+    LOGS_DIR.mkdir(parents=True, exist_ok=True)
+    n = 0
+    while True:
+        out = LOGS_DIR / (f"{prefix}_{ts}.pdf" if n == 0 else f"{prefix}_{ts}_{n}.pdf")
+        try:
+            with open(out, "x"):
+                return out
+        except FileExistsError:
+            n += 1
 
 
 def append_log_pdf(prefix: str, text: str) -> str:
     """Write a short log entry as a single-page PDF."""
     ts = utc_timestamp()
-    name = f"{prefix}_{ts}.pdf"
-    out = LOGS_DIR / name
-    _text_to_pdf(text, out, title=f"{prefix} {ts}")
+    out = _reserve_log_path(prefix, ts)
+    title = f"{prefix} {ts}"
+    data = _log_pdf_bytes(text or "", title)
+    if data is not None:
+        out.write_bytes(data)
+    else:
+        _text_to_pdf(text, out, title=title)
     return str(out.resolve())
 
 
@@ -139,22 +265,45 @@ def append_log_pdf(prefix: str, text: str) -> str:
 # Text & PDF helpers
 # -------------------------------------------------------------------
 def extract_text(path: str) -> str:
+    """
+    Text of a PDF/TXT/MD file. Memoized on (resolved path, mtime, size), so the same
+    unchanged file is only parsed once per process.
+    """
     if not path:
         return ""
     p = Path(path)
-    if not p.exists():
+    try:
+        st = p.stat()
+    except OSError:
         return ""
+    return _extract_text_cached(str(p.resolve()), st.st_mtime_ns, st.st_size)
+
+
+@lru_cache(maxsize=64)
+def _extract_text_cached(path: str, mtime_ns: int, size: int) -> str:
+    p = Path(path)
     ext = p.suffix.lower()
 
     # PDF
     if ext == ".pdf":
         try:
-            reader = PdfReader(str(p))
+            pages = extract_pages_pdfium(str(p))
+            if pages is not None:
+                return "\n".join(pages).strip()
+        except Exception as e:
+            logger.debug("PDFium failed on %s (%s); falling back to pypdf", path, e)
+        try:
+            from pypdf import PdfReader
+
+            # One sequential read; pypdf's xref/object seeks then hit memory, not the file
+            reader = PdfReader(io.BytesIO(p.read_bytes()))
             pages = []
-            for page in reader.pages:
+            for i, page in enumerate(reader.pages):
                 try:
                     pages.append(page.extract_text() or "")
-                except Exception:
+                except Exception as e:
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("Page %d of %s could not be extracted: %s", i, path, e)
                     pages.append("")
             return "\n".join(pages).strip()
         except Exception as e:
@@ -177,8 +326,12 @@ def extract_text(path: str) -> str:
         return ""
 
 
-def _text_to_pdf(text: str, out_path: Path, title: Optional[str] = None):
-    """Write text into a (multi-page) PDF."""
+def _text_to_pdf(text: Union[str, Iterable[str]], out_path: Path, title: Optional[str] = None):
+    """Write text into a (multi-page) PDF. `text` may also be an iterable of lines,
+    which is consumed lazily (no combined string is ever built)."""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
     out_path.parent.mkdir(parents=True, exist_ok=True)
     c = canvas.Canvas(str(out_path), pagesize=letter)
     width, height = letter
@@ -189,24 +342,34 @@ def _text_to_pdf(text: str, out_path: Path, title: Optional[str] = None):
         c.drawString(40, y, title)
         y -= 28
 
-    c.setFont("Helvetica", 9)
-
-    for line in (text or "").splitlines():
-        line = str(line)
-        while len(line) > 140:
-            c.drawString(40, y, line[:140])
-            line = line[140:]
-            y -= 11
+    page_top = height - 40
+
+    def _new_text_object(top: float):
+        # One text object per page: each line is a single Tj/T* pair instead of a
+        # full BT..ET block per drawString call
+        t = c.beginText(40, top)
+        t.setFont("Helvetica", 9, leading=11)
+        return t
+
+    text_obj = _new_text_object(y)
+    page_lines = 0
+    lines = (text or "").splitlines() if isinstance(text, str) or text is None else text
+    for line in lines:
+        # Slice long lines into 140-char segments in one pass (no repeated re-slicing)
+        for segment in [line[i:i + 140] for i in range(0, len(line), 140)] or [""]:
+            # Break the page only when another line actually needs it, so text that
+            # ends exactly at the bottom margin leaves no trailing blank page
             if y < 40:
+                c.drawText(text_obj)
                 c.showPage()
-                y = height - 40
-                c.setFont("Helvetica", 9)
-        c.drawString(40, y, line)
-        y -= 11
-        if y < 40:
-            c.showPage()
-            y = height - 40
-            c.setFont("Helvetica", 9)
+                y = page_top
+                text_obj = _new_text_object(y)
+                page_lines = 0
+            text_obj.textLine(segment)
+            page_lines += 1
+            y -= 11
+    if page_lines:
+        c.drawText(text_obj)
 
     c.save()
 
@@ -221,15 +384,57 @@ def save_text_artifact(name_prefix: str, text: str, folder: Path) -> str:
 # -------------------------------------------------------------------
 # Download helpers
 # -------------------------------------------------------------------
-def download_binary(url: str, out_path: Path, timeout: int = 40) -> bool:
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+
+
+@lru_cache(maxsize=1)
+def _get_session():
+    """Keep-alive session shared by all downloads (TLS connections are pooled).
+    Built on first download, so importing regupdate does not load requests."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    session.headers.update({"User-Agent": "Mozilla/5.0"})
+    retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def download_binary(url: str, out_path: Path, timeout: int = 40, cache_meta: Optional[Dict] = None) -> bool:
+    """
+    Download url to out_path. With `cache_meta` (the validators saved from the last
+    download of this URL) the request is conditional: on 304 Not Modified the file
+    already on disk is kept. `cache_meta` is updated in place after a new download.
+    """
     out_path.parent.mkdir(parents=True, exist_ok=True)
+    headers = {}
+    # Only trust the validators if the local copy is the file they describe
+    if cache_meta and out_path.exists() and out_path.stat().st_size == cache_meta.get("size"):
+        if cache_meta.get("etag"):
+            headers["If-None-Match"] = cache_meta["etag"]
+        if cache_meta.get("last_modified"):
+            headers["If-Modified-Since"] = cache_meta["last_modified"]
     try:
-        r = requests.get(url, stream=True, timeout=timeout, headers={"User-Agent": "Mozilla/5.0"})
+        r = _get_session().get(url, stream=True, timeout=timeout, headers=headers)
+        if r.status_code == 304 and headers:
+            r.close()
+            return True
         r.raise_for_status()
         with open(out_path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
+            for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
                 if chunk:
                     f.write(chunk)
+        if cache_meta is not None:
+            cache_meta.clear()
+            cache_meta.update({
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified"),
+                "size": out_path.stat().st_size,
+            })
         return True
     except Exception as e:
         append_log_pdf("download_error", f"Failed to download {url}: {e}")
@@ -238,7 +443,7 @@ def download_binary(url: str, out_path: Path, timeout: int = 40) -> bool:
 
 def download_text(url: str, timeout: int = 40) -> str:
     try:
-        r = requests.get(url, timeout=timeout, headers={"User-Agent": "Mozilla/5.0"})
+        r = _get_session().get(url, timeout=timeout)
         r.raise_for_status()
         return r.text
     except Exception as e:
@@ -246,13 +451,31 @@ def download_text(url: str, timeout: int = 40) -> str:
         return ""
 
 
+# Guards REG_HTTP_CACHE_JSON, which the concurrent fetchers all update
+_HTTP_CACHE_LOCK = threading.Lock()
+
+
+def download_binary_cached(url: str, out_path: Path) -> bool:
+    """download_binary with the URL's ETag / Last-Modified persisted in REG_HTTP_CACHE_JSON."""
+    with _HTTP_CACHE_LOCK:
+        meta = dict(load_json(REG_HTTP_CACHE_JSON).get(url) or {})
+    if not download_binary(url, out_path, cache_meta=meta):
+        return False
+    with _HTTP_CACHE_LOCK:
+        http_cache = load_json(REG_HTTP_CACHE_JSON)
+        if http_cache.get(url) != meta:
+            http_cache[url] = meta
+            save_json(REG_HTTP_CACHE_JSON, http_cache)
+    return True
+
+
 # -------------------------------------------------------------------
 # Regulation fetchers (EU GDPR + Indian DPDP + SPDI)
 # -------------------------------------------------------------------
 def fetch_gdpr_text() -> str:
     url = "https://eur-lex.europa.eu/legal-content/EN/TXT/PDF/?uri=CELEX:32016R0679"
     pdf_tmp = REG_DIR / "EU_GDPR_source.pdf"
-    if download_binary(url, pdf_tmp):
+    if download_binary_cached(url, pdf_tmp):
         text = extract_text(str(pdf_tmp))
         if text.strip():
             return text
@@ -262,73 +485,105 @@ def fetch_gdpr_text() -> str:
 def fetch_dpdp_text() -> str:
     url = "https://prsindia.org/files/bills_acts/acts_parliament/2023/Digital_Personal_Data_Protection_Act_2023.pdf"
     pdf_tmp = REG_DIR / "IN_DPDP_source.pdf"
-    if download_binary(url, pdf_tmp):
+    if download_binary_cached(url, pdf_tmp):
         text = extract_text(str(pdf_tmp))
         if text.strip():
             return text
     return "The Digital Personal Data Protection Act, 2023 - Summary text."
 
 
+_TAG_RE = re.compile(r"<[^>]+>")
+_WS_RE = re.compile(r"\s+")
+
+
+def html_to_text(html: str) -> str:
+    """Visible text of an HTML page with whitespace collapsed."""
+    if HTMLParser is not None:
+        # One C pass; <script>/<style> bodies are dropped instead of leaking through
+        tree = HTMLParser(html)
+        tree.strip_tags(["script", "style", "noscript"])
+        root = tree.body or tree.root
+        text = root.text(separator=" ") if root is not None else ""
+    else:
+        text = _TAG_RE.sub(" ", html)
+    return _WS_RE.sub(" ", text)
+
+
 def fetch_spdi_text() -> str:
     url = "https://www.meity.gov.in/content/rules-sensitive-personal-data-or-information"
     html = download_text(url)
     if html.strip():
-        clean_text = re.sub(r"<[^>]+>", " ", html)
-        clean_text = re.sub(r"\s+", " ", clean_text)
-        return "SPDI Rules 2011 Summary:\n" + clean_text[:5000]
+        return "SPDI Rules 2011 Summary:\n" + html_to_text(html)[:5000]
     return "SPDI Rules under Indian IT Act - Summary text."
 
 
+REGULATION_SOURCES = [
+    # (id, title, source, fetcher) -- fetched concurrently, listed in manifest order
+    ("EU_GDPR", "EU General Data Protection Regulation (GDPR)", "EUR-Lex", fetch_gdpr_text),
+    ("IN_DPDP", "Digital Personal Data Protection Act, 2023 (India)", "PRS India", fetch_dpdp_text),
+    ("IN_SPDI_RULES", "IT (Reasonable Security Practices) Rules, 2011", "MeitY", fetch_spdi_text),
+]
+
+
 def fetch_all_regulations() -> List[Dict]:
-    regs: List[Dict] = []
     ts_version = utc_timestamp()
 
-    gdpr_text = fetch_gdpr_text()
-    regs.append({
-        "id": "EU_GDPR",
-        "title": "EU General Data Protection Regulation (GDPR)",
-        "source": "EUR-Lex",
-        "version": ts_version,
-        "text": gdpr_text,
-    })
-
-    dpdp_text = fetch_dpdp_text()
-    regs.append({
-        "id": "IN_DPDP",
-        "title": "Digital Personal Data Protection Act, 2023 (India)",
-        "source": "PRS India",
-        "version": ts_version,
-        "text": dpdp_text,
-    })
-
-    spdi_text = fetch_spdi_text()
-    regs.append({
-        "id": "IN_SPDI_RULES",
-        "title": "IT (Reasonable Security Practices) Rules, 2011",
-        "source": "MeitY",
-        "version": ts_version,
-        "text": spdi_text,
-    })
+    # The fetchers are network-bound, so run them side by side
+    with ThreadPoolExecutor(max_workers=len(REGULATION_SOURCES)) as ex:
+        futures = [ex.submit(fetcher) for _, _, _, fetcher in REGULATION_SOURCES]
+        texts = [f.result() for f in futures]
 
+    regs: List[Dict] = []
+    for (rid, title, source, _), text in zip(REGULATION_SOURCES, texts):
+        regs.append({
+            "id": rid,
+            "title": title,
+            "source": source,
+            "version": ts_version,
+            "text": text,
+        })
     return regs
 
 
+# Keywords the chatbot matches queries against (see chatbot.search_regulations)
+REGULATION_KEYWORDS: List[str] = ["gdpr", "dpdp", "hipaa", "ccpa", "privacy", "data", "compliance", "security"]
+
+
+def get_regulation_text(reg_manifest: Dict) -> str:
+    """Full text of a registered regulation (inline 'text' in manifests written before 'text_path')."""
+    if "text" in reg_manifest:
+        return reg_manifest.get("text") or ""
+    return extract_text(reg_manifest.get("text_path") or "")
+
+
+def _snapshot_lines(reg_items: List[Dict]) -> Iterator[str]:
+    """Lines of the regulations snapshot, one regulation at a time."""
+    for i, r in enumerate(reg_items):
+        if i:
+            yield ""
+        yield f"=== {r['id']} ==="
+        yield f"Title: {r.get('title')}"
+        yield f"Source: {r.get('source')}"
+        yield f"Version: {r.get('version')}"
+        yield "-" * 80
+        yield ""
+        yield from (r.get("text", "").strip() or "[No text]").splitlines()
+        yield ""
+        yield ""
+
+
 def build_regulations_snapshot_pdf(reg_items: List[Dict]) -> str:
     if not reg_items: return ""
-    parts: List[str] = []
-    for r in reg_items:
-        header = f"=== {r['id']} ===\nTitle: {r.get('title')}\nSource: {r.get('source')}\nVersion: {r.get('version')}\n{'-' * 80}\n"
-        parts.append(header)
-        parts.append(r.get("text", "").strip() or "[No text]")
-        parts.append("\n\n")
-
-    combined = "\n".join(parts)
     ts = utc_timestamp()
     out_path = REG_SNAPSHOTS_DIR / f"REGULATIONS_SNAPSHOT_{ts}.pdf"
-    _text_to_pdf(combined, out_path, title="Regulations Snapshot")
+    _text_to_pdf(_snapshot_lines(reg_items), out_path, title="Regulations Snapshot")
     return str(out_path.resolve())
 
 
+def regulation_digest(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
 def register_regulations() -> List[str]:
     logs: List[str] = []
     reg_data_existing = load_json(REG_MANIFESTS_JSON)
@@ -337,10 +592,28 @@ def register_regulations() -> List[str]:
     if not new_regs:
         return ["No regulations fetched."]
 
+    # Only regulations whose text actually changed are re-registered
+    changed = []
+    for r in new_regs:
+        digest = regulation_digest(r["text"])
+        existing = reg_data_existing.get(r["id"]) or {}
+        if existing.get("digest") == digest and Path(existing.get("text_path") or "").is_file():
+            r["version"] = existing.get("version", r["version"])  # snapshot shows the registered version
+            logs.append(f"Unchanged regulation: {r['id']} (v{r['version']})")
+        else:
+            changed.append((r, digest))
+
+    if not changed:
+        return logs
+
     snapshot_pdf = build_regulations_snapshot_pdf(new_regs)
 
-    for r in new_regs:
+    for r, digest in changed:
         rid = r["id"]
+        text_l = r["text"].lower()
+        # The full text lives next to the manifest, so loading the manifest stays cheap
+        text_path = REG_TEXTS_DIR / f"{rid}.txt"
+        text_path.write_text(r["text"], encoding="utf-8")
         reg_data_existing[rid] = {
             "id": rid,
             "title": r["title"],
@@ -348,10 +621,20 @@ def register_regulations() -> List[str]:
             "version": r["version"],
             "last_updated": utc_now_iso(),
             "snapshot_pdf": snapshot_pdf,
-            "text": r["text"],
+            "text_path": str(text_path.resolve()),
+            "digest": digest,
+            # Precomputed for chatbot.search_regulations (no full-text scan per query)
+            "keywords": sorted(kw for kw in REGULATION_KEYWORDS if kw in text_l),
+            "snippet": r["text"][:700],
+            # Precomputed for generate_suggestions_for_reg
+            "triggers": sorted(suggestion_triggers(text_l)),
         }
         logs.append(f"Updated regulation: {rid} (v{r['version']})")
 
+    # The new snapshot covers every regulation, unchanged ones included
+    for r in new_regs:
+        reg_data_existing[r["id"]]["snapshot_pdf"] = snapshot_pdf
+
     save_json(REG_MANIFESTS_JSON, reg_data_existing)
     return logs
 
@@ -367,8 +650,10 @@ def register_contract_from_path(path_str: str) -> str:
     cid = p.stem
     dest = CONTRACT_DIR / p.name
     try:
-        with open(p, "rb") as fsrc, open(dest, "wb") as fdst:
-            fdst.write(fsrc.read())
+        # Kernel-side copy (sendfile/copy_file_range) where available, else chunked
+        shutil.copyfile(p, dest)
+    except shutil.SameFileError:
+        pass  # re-registering a file that already lives in CONTRACT_DIR
     except Exception as e:
         return f"Failed to copy: {e}"
 
@@ -393,28 +678,59 @@ RISK_KEYWORDS: Dict[str, List[str]] = {
     "low": ["dispute resolution", "notice period", "audit"],
 }
 
+_RISK_PHRASES: List[str] = [kw for kws in RISK_KEYWORDS.values() for kw in kws]
+
+# All risk phrases in one alternation: a single scan of the contract finds every
+# position where some phrase starts. Being zero-width, the lookahead lets matches
+# overlap, but it records only the first alternative at each position, so phrases
+# sharing a start (e.g. "audit" and "audit rights") are re-checked in detect_risks.
+_RISK_RE = re.compile("(?=" + "|".join(re.escape(kw) for kw in _RISK_PHRASES) + ")")
+
+
 def detect_risks(text: str) -> List[Tuple[str, str]]:
     if not text: return []
-    t = text.lower()
-    findings = []
-    for level, kws in RISK_KEYWORDS.items():
-        for kw in kws:
-            if kw in t: findings.append((level, kw))
-    return findings
+    low = text.lower()
+    found = set()
+    for m in _RISK_RE.finditer(low):
+        pos = m.start()
+        found.update(kw for kw in _RISK_PHRASES if low.startswith(kw, pos))
+    if not found: return []
+    # Report in RISK_KEYWORDS order, as before
+    return [(level, kw) for level, kws in RISK_KEYWORDS.items() for kw in kws if kw in found]
+
 
+# Phrases that switch on a suggestion (see generate_suggestions_for_reg)
+SUGGESTION_TRIGGERS: List[str] = ["consent", "breach", "digital personal data"]
+_SUGGESTION_TRIGGER_RE = re.compile(
+    "(?=(" + "|".join(re.escape(t) for t in SUGGESTION_TRIGGERS) + "))"
+)
 
-def generate_suggestions_for_reg(reg_manifest: Dict, contract_text: str, risks: List[Tuple[str, str]]) -> str:
+
+def suggestion_triggers(text_lower: str) -> frozenset:
+    """SUGGESTION_TRIGGERS present in an already-lowercased text, found in one scan."""
+    return frozenset(m.group(1) for m in _SUGGESTION_TRIGGER_RE.finditer(text_lower))
+
+
+def generate_suggestions_for_reg(reg_manifest: Dict, contract_text: str, risks: List[Tuple[str, str]],
+                                 contract_triggers: Optional[frozenset] = None) -> str:
     title = reg_manifest.get("title") or reg_manifest.get("id")
-    reg_l = (reg_manifest.get("text") or "").lower()
-    ct_l = contract_text.lower()
+    # 'triggers' is precomputed by register_regulations; older manifests fall back to a scan
+    if "triggers" in reg_manifest:
+        reg_triggers = frozenset(reg_manifest["triggers"])
+    else:
+        reg_triggers = suggestion_triggers(get_regulation_text(reg_manifest).lower())
+    # Callers looping over regulations scan the contract once and pass the result
+    if contract_triggers is None:
+        contract_triggers = suggestion_triggers(contract_text.lower())
+    found = reg_triggers | contract_triggers
 
     parts = [f"Suggestions based on: {title}"]
 
-    if "consent" in reg_l or "consent" in ct_l:
+    if "consent" in found:
         parts.append("- Ensure explicit consent language (purpose, withdrawal).")
-    if "breach" in reg_l or "breach" in ct_l:
+    if "breach" in found:
         parts.append("- Add breach notification clause (timelines, responsibilities).")
-    if "digital personal data" in reg_l:
+    if "digital personal data" in reg_triggers:
         parts.append("- Align with DPDP: define data principals and grievance redress.")
 
     for level, issue in risks:
@@ -426,16 +742,18 @@ def generate_suggestions_for_reg(reg_manifest: Dict, contract_text: str, risks:
 # -------------------------------------------------------------------
 # MAIN UPDATE LOGIC (Orchestrator) - [UPDATED]
 # -------------------------------------------------------------------
-def apply_updates_to_contract(cid: str, auto_apply: bool = True) -> str:
+def apply_updates_to_contract(cid: str, auto_apply: bool = True, queue_email: bool = False) -> str:
     """
     1. Generates Suggestions PDF based on 'current_version_path'.
     2. Runs RAG AI to generate Rectified Contract PDF.
-    3. Emails BOTH to the user.
+    3. Emails BOTH to the user (with `queue_email`, hands it to mail's background
+       outbox and returns at once).
     4. UPDATES SYSTEM: 
        - Sets 'current_version_path' to the NEW rectified PDF.
        - DELETES the OLD 'current_version_path' (if it wasn't the original).
     """
     contract_manifests = load_json(CONTRACT_MANIFESTS_JSON)
+    manifest_stamp = _json_stamp(CONTRACT_MANIFESTS_JSON)
     m = contract_manifests.get(cid)
     if not m:
         return f"No such contract: {cid}"
@@ -454,33 +772,34 @@ def apply_updates_to_contract(cid: str, auto_apply: bool = True) -> str:
         return "No regulations registered. Run option 3 first."
 
     # --- 1. Detect Risks & Generate Suggestions PDF ---
-    print(f"\n--- Analyzing {cid} ---")
-    print(f"📄 Input Data: {Path(cpath).name}")
+    logger.info("--- Analyzing %s ---", cid)
+    logger.info("📄 Input Data: %s", Path(cpath).name)
     
     risks = detect_risks(ctext)
+    ctext_triggers = suggestion_triggers(ctext.lower())
     combined_sections = []
     
     for rid, r in reg_manifests.items():
-        sugg = generate_suggestions_for_reg(r, ctext, risks)
+        sugg = generate_suggestions_for_reg(r, ctext, risks, contract_triggers=ctext_triggers)
         combined_sections.append(f"### Regulation: {rid}\n{sugg}\n")
 
     combined_text = "\n".join(combined_sections)
     suggestions_pdf = save_text_artifact(f"{cid}_SUGGESTIONS", combined_text, SUGGESTIONS_DIR)
     
-    # Update manifest with suggestions link
+    # Update manifest with suggestions link (written together with step 4 below)
     m["last_suggestions_pdf"] = suggestions_pdf
     contract_manifests[cid] = m
-    save_json(CONTRACT_MANIFESTS_JSON, contract_manifests)
 
     # --- 2. Run RAG Rectification (Generate Fixed Contract PDF) ---
     rectified_pdf_path = None
-    if RAG_AVAILABLE and auto_apply:
-        print(f"🤖 Invoking RAG AI to rectify contract...")
+    run_rectification_pipeline = _rectification_pipeline() if auto_apply else None
+    if run_rectification_pipeline is not None:
+        logger.info("🤖 Invoking RAG AI to rectify contract...")
         try:
             # Call the function from rag.py
             rectified_pdf_path = run_rectification_pipeline(cpath)
         except Exception as e:
-            print(f"❌ RAG Error: {e}")
+            logger.error("❌ RAG Error: %s", e)
             append_log_pdf("rag_error", str(e))
 
     # --- 3. Handle Files: Email & Update Inputs ---
@@ -491,40 +810,50 @@ def apply_updates_to_contract(cid: str, auto_apply: bool = True) -> str:
     # Send Email
     USER_EMAIL = "suryalokesh.g1432@gmail.com" 
     if files_to_send:
-        print(f"📧 Sending email to {USER_EMAIL}...")
+        logger.info("📧 Sending email to %s...", USER_EMAIL)
         try:
-            send_compliance_update_email(
+            email_kwargs = dict(
                 recipient_email=USER_EMAIL,
                 contract_title=cid,
                 regulation_name="GDPR + Indian Data Laws",
                 new_version=reg_manifests[next(iter(reg_manifests))]["version"],
                 attachments=files_to_send,
             )
+            if queue_email:
+                enqueue_compliance_update_email(**email_kwargs)
+            else:
+                send_compliance_update_email(**email_kwargs)
         except Exception as e:
-            print(f"❌ Email Failed: {e}")
+            logger.error("❌ Email Failed: %s", e)
 
     # --- 4. CRITICAL: Update System State (The "New Data" Logic) ---
     msg = f"Completed. Suggestions: {Path(suggestions_pdf).name}"
     
+    old_version_path = m.get("current_version_path")
+    original_path = m.get("path")
     if rectified_pdf_path:
-        old_version_path = m.get("current_version_path")
-        original_path = m.get("path")
-
         # A. Set new file as the CURRENT input for next run
         m["current_version_path"] = str(rectified_pdf_path)
         m["last_updated"] = utc_now_iso()
-        
-        save_json(CONTRACT_MANIFESTS_JSON, contract_manifests)
-        print(f"🔄 System Updated: New input data is {Path(rectified_pdf_path).name}")
+
+    # One manifest write for all of the above, before any old file is deleted
+    if _json_stamp(CONTRACT_MANIFESTS_JSON) != manifest_stamp:
+        # Changed on disk during the RAG run (e.g. by the app): keep those edits
+        contract_manifests = load_json(CONTRACT_MANIFESTS_JSON)
+        contract_manifests[cid] = m
+    save_json(CONTRACT_MANIFESTS_JSON, contract_manifests)
+
+    if rectified_pdf_path:
+        logger.info("🔄 System Updated: New input data is %s", Path(rectified_pdf_path).name)
 
         # B. Remove the OLD document (if it wasn't the original backup)
         # This satisfies "remove the old doc as input" by physically deleting intermediate versions.
         if old_version_path and old_version_path != original_path and old_version_path != str(rectified_pdf_path):
             try:
                 Path(old_version_path).unlink()
-                print(f"🗑️ Removed old input file: {Path(old_version_path).name}")
+                logger.info("🗑️ Removed old input file: %s", Path(old_version_path).name)
             except Exception as e:
-                print(f"⚠️ Could not delete old file: {e}")
+                logger.warning("⚠️ Could not delete old file: %s", e)
         
         msg += f" | Rectified: {Path(rectified_pdf_path).name} (Now Active Input)"
         
@@ -570,8 +899,11 @@ def cli_menu():
             if not contract_manifests:
                 print("No contracts.")
             else:
+                # Emails go out from the background outbox (batched over one SMTP
+                # connection) while the next contract is being rectified
                 for cid in contract_manifests.keys():
-                    print(apply_updates_to_contract(cid))
+                    print(apply_updates_to_contract(cid, queue_email=True))
+                flush_email_queue()
         elif choice == "5":
             files = sorted(SUGGESTIONS_DIR.glob("*.pdf"))
             for f in files: print(f.name)
@@ -581,4 +913,5 @@ def cli_menu():
             print("Invalid.")
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     cli_menu()
\ No newline at end of file